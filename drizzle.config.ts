@@ -3,6 +3,8 @@ import type { Config } from "drizzle-kit";
 export default {
   schema: "./shared/schema.ts", // Updated path
   out: "./drizzle",
+  // Ingestion journal owned by upload_financials.py; db:push must never drop it
+  tablesFilter: ["!ingest_*"],
   dialect: "postgresql",
   dbCredentials: {
     url: process.env.DATABASE_URL!,
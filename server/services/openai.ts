@@ -1,6 +1,6 @@
 import OpenAI from "openai";
 import { searchSimilarChunks } from "./vectorSearch.js";
-import { eq, desc, isNotNull } from "drizzle-orm";
+import { eq, desc, isNotNull, and } from "drizzle-orm";
 import { conversations, messages, uploadedFiles } from "../../shared/schema.js";
 import { db } from "../db.js";
 
@@ -216,7 +216,7 @@ export async function getAllExtractedTexts() {
         filename: uploadedFiles.originalName,
       })
       .from(uploadedFiles)
-      .where(isNotNull(uploadedFiles.extractedText))
+      .where(and(isNotNull(uploadedFiles.extractedText), eq(uploadedFiles.processed, true)))
       .orderBy(desc(uploadedFiles.uploadedAt))
       .limit(15);
 
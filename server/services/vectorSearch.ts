@@ -1,11 +1,12 @@
 import { db } from "../db.js";
 import { uploadedFiles, documentChunks } from "../../shared/schema.js";
-import { sql, isNotNull, desc } from "drizzle-orm";
+import { sql, isNotNull, desc, and, eq } from "drizzle-orm";
 import { getEmbedding } from "../utils/embeddings.js";
 
 /**
  * Perform semantic vector search with fallback to text-based retrieval
  * Includes grouping by file, summary embeddings, and similarity threshold
+ * Only processed files are searched: the uploader commits unfinished files in batches
  */
 export async function searchSimilarChunks(
   query,
@@ -34,7 +35,7 @@ export async function searchSimilarChunks(
           1 - (dc.embedding <=> ${vectorLiteral}::vector) AS similarity
         FROM document_chunks dc
         JOIN uploaded_files uf ON dc.file_id = uf.id
-        WHERE dc.embedding IS NOT NULL
+        WHERE dc.embedding IS NOT NULL AND uf.processed = true
       )
       UNION ALL
       (
@@ -43,7 +44,7 @@ export async function searchSimilarChunks(
           uf.original_name AS filename,
           1 - (uf.embedding <=> ${vectorLiteral}::vector) AS similarity
         FROM uploaded_files uf
-        WHERE uf.embedding IS NOT NULL
+        WHERE uf.embedding IS NOT NULL AND uf.processed = true
       )
       ORDER BY similarity DESC
       LIMIT ${limit * 3}  -- fetch extra before filtering/grouping
@@ -113,7 +114,7 @@ async function fallbackTextSearch(query, limit) {
         filename: uploadedFiles.originalName,
       })
       .from(uploadedFiles)
-      .where(isNotNull(uploadedFiles.extractedText))
+      .where(and(isNotNull(uploadedFiles.extractedText), eq(uploadedFiles.processed, true)))
       .orderBy(desc(uploadedFiles.uploadedAt))
       .limit(limit);
 
@@ -142,7 +143,7 @@ export async function getAllDocumentTexts(limit = 10) {
         filename: uploadedFiles.originalName,
       })
       .from(uploadedFiles)
-      .where(isNotNull(uploadedFiles.extractedText))
+      .where(and(isNotNull(uploadedFiles.extractedText), eq(uploadedFiles.processed, true)))
       .orderBy(desc(uploadedFiles.uploadedAt))
       .limit(limit);
 
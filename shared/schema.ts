@@ -1,4 +1,4 @@
-import { pgTable, varchar, text, timestamp, jsonb, integer, boolean, vector, serial } from "drizzle-orm/pg-core";
+import { pgTable, varchar, text, timestamp, jsonb, integer, bigint, boolean, vector, serial, index, type AnyPgColumn } from "drizzle-orm/pg-core";
 import { relations } from "drizzle-orm";
 import { createInsertSchema } from "drizzle-zod";
 import { z } from "zod";
@@ -44,9 +44,15 @@ export const documentChunks = pgTable("document_chunks", {
   fileId: varchar("file_id", { length: 36 }).notNull().references(() => uploadedFiles.id, { onDelete: "cascade" }),
   chunkText: text("chunk_text").notNull(),
   chunkIndex: integer("chunk_index").notNull(),
-  embedding: vector("embedding", { dimensions: 1536 }), // Vector for chunk embeddings
+  embedding: vector("embedding", { dimensions: 1536 }), // Vector for chunk embeddings (NULL for near-duplicates)
+  // Near-duplicate links written by upload_financials.py: a duplicate reuses its canonical chunk's embedding
+  canonicalId: integer("canonical_id").references((): AnyPgColumn => documentChunks.id, { onDelete: "set null" }),
+  minhash: bigint("minhash", { mode: "number" }).array(),
+  figuresHash: bigint("figures_hash", { mode: "number" }),
   createdAt: timestamp("created_at").defaultNow().notNull(),
-});
+}, (table) => ({
+  canonicalIdx: index("idx_chunks_canonical").on(table.canonicalId),
+}));
 
 // API Logs Table
 export const apiLogs = pgTable("api_logs", {
@@ -6,6 +6,9 @@ SOYOSOYO SACCO CHATBOT + UPLOADER v14 – FERRARI EDITION (MERGED IMPROVEMENTS)
 - FIXED: Better dirty data handling (e.g., "KES 1,000" → 1000)
 - Chunking: 1200 chars + 300 overlap for max context
 - Hybrid search: Vector + keyword, bilingual responses
+- Near-duplicate chunks: MinHash/LSH reuses embeddings of repeated boilerplate, retrieval collapses copies
+- Batch eval: python3 upload_financials.py --batch questions.jsonl --concurrency 8 (throughput + p50/p95/p99)
+- Resumable ingestion: job journal (extracted → embedded → written), commits every 50 chunks, restart resumes
 - Ready to run: python3 app.py (install: pip install pymupdf)
 - Performance: Efficient SQL batches, validation, logging
 """
@@ -15,6 +18,7 @@ import re
 import json
 import glob
 import base64
+import hashlib
 import psycopg
 from pathlib import Path
 from typing import List, Dict, Any, Optional
@@ -24,6 +28,11 @@ import numpy as np
 from openai import OpenAI
 import warnings
 import sys
+import time
+import zlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import fitz  # PyMuPDF for PDF extraction
 
 # ===================== CONFIG =====================
@@ -41,6 +50,15 @@ SUPPORTED_MIME = {
     '.csv': 'text/csv'
 }
 
+# Near-duplicate chunks (monthly boilerplate) reuse an existing embedding
+NEAR_DUP_THRESHOLD = 0.9   # estimated Jaccard similarity of word shingles
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32             # 32 bands x 4 rows
+SHINGLE_SIZE = 5
+
+# Ingestion commits every CHUNK_BATCH_SIZE chunks; a restart resumes at the first unwritten chunk
+CHUNK_BATCH_SIZE = 50
+
 warnings.filterwarnings("ignore", message=r".*chunkSizeWarningLimit.*", category=UserWarning, module=r"openpyxl")
 
 if not DATABASE_URL or not OPENAI_API_KEY:
@@ -153,10 +171,149 @@ def generate_embeddings(chunks: List[str]) -> List[List[float]]:
         print(f"Embedding error: {e}")
         return [[] for _ in chunks]
 
-def generate_summary_embedding(chunks: List[str]) -> List[float]:
-    embs = generate_embeddings(chunks)
-    valid = [e for e in embs if e and len(e) == 1536]
-    return np.mean(valid, axis=0).tolist() if valid else []
+# ===================== NEAR-DUPLICATE INDEX =====================
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_perm_rng = np.random.RandomState(1)  # fixed seed: signatures are stored in the DB
+_PERM_A = _perm_rng.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _perm_rng.randint(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash_signature(text: str) -> List[int]:
+    """MinHash over word 5-gram shingles (case/whitespace insensitive)."""
+    tokens = re.findall(r'\w+', text.lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        shingles = {" ".join(tokens)}
+    else:
+        shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = np.array([zlib.crc32(s.encode()) for s in shingles], dtype=np.uint64)
+    permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return [int(v) for v in permuted.min(axis=0)]
+
+def figures_hash(text: str) -> int:
+    """Fingerprint of the numbers in a chunk: same boilerplate with different figures is NOT a duplicate."""
+    return zlib.crc32(" ".join(re.findall(r'\d+(?:[.,]\d+)*', text)).encode())
+
+class NearDuplicateIndex:
+    """MinHash LSH over canonical chunks: finds an existing chunk nearly identical to a new one."""
+
+    def __init__(self):
+        self.rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        self.buckets: Dict[tuple, List[Any]] = {}
+        self.entries: Dict[Any, tuple] = {}  # key -> (signature, figures hash)
+
+    def _bands(self, signature: List[int]):
+        for b in range(LSH_BANDS):
+            yield (b, tuple(signature[b * self.rows:(b + 1) * self.rows]))
+
+    def add(self, key, signature: List[int], figures: int):
+        self.entries[key] = (signature, figures)
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, []).append(key)
+
+    def discard(self, key):
+        self.entries.pop(key, None)  # stale bucket references are skipped by query()
+
+    def query(self, signature: List[int], figures: int):
+        """Return the key of the most similar entry above NEAR_DUP_THRESHOLD, or None."""
+        best, best_sim = None, NEAR_DUP_THRESHOLD
+        seen = set()
+        for band in self._bands(signature):
+            for key in self.buckets.get(band, ()):
+                if key in seen or key not in self.entries:
+                    continue
+                seen.add(key)
+                other, other_figures = self.entries[key]
+                if other_figures != figures:
+                    continue
+                sim = sum(a == b for a, b in zip(signature, other)) / MINHASH_PERMUTATIONS
+                if sim >= best_sim:
+                    best, best_sim = key, sim
+        return best
+
+def load_near_duplicate_index(cur, file_id: Optional[int] = None) -> NearDuplicateIndex:
+    """Index canonical chunks (those holding their own embedding) of processed files, or of one file when file_id is given.
+
+    Chunks from earlier runs are only found when the schema persists between runs (no --reset);
+    otherwise only duplicates within the current run are caught. Unfinished uploads are left out:
+    vector search only returns canonicals of processed files.
+    """
+    index = NearDuplicateIndex()
+    sql = """
+        SELECT dc.id, dc.minhash, dc.figures_hash
+        FROM document_chunks dc JOIN uploaded_files uf ON dc.file_id = uf.id
+        WHERE dc.canonical_id IS NULL AND dc.embedding IS NOT NULL AND dc.minhash IS NOT NULL
+    """
+    if file_id is None:
+        cur.execute(sql + " AND uf.processed = true")
+    else:
+        cur.execute(sql + " AND uf.id = %s", (file_id,))
+    for chunk_id, signature, figures in cur.fetchall():
+        index.add(chunk_id, list(signature), figures)
+    return index
+
+def plan_near_duplicates(signatures: List[List[int]], figures: List[int], index: NearDuplicateIndex,
+                         job_index: Optional[NearDuplicateIndex] = None) -> List[Optional[tuple]]:
+    """Per chunk: None (new canonical), ('row', chunk_id) for a stored match, or ('local', i) for an earlier chunk of this batch.
+
+    job_index holds canonicals already written by the current (unfinished) upload.
+    """
+    local = NearDuplicateIndex()
+    links = []
+    for i, (sig, fig) in enumerate(zip(signatures, figures)):
+        match = index.query(sig, fig)
+        if match is None and job_index is not None:
+            match = job_index.query(sig, fig)
+        if match is not None:
+            links.append(('row', match))
+            continue
+        match = local.query(sig, fig)
+        if match is not None:
+            links.append(('local', match))
+            continue
+        local.add(i, sig, fig)
+        links.append(None)
+    return links
+
+def release_canonical_chunks(cur, original_names: List[str], index: Optional[NearDuplicateIndex] = None):
+    """Before deleting files, hand each canonical chunk's embedding to a surviving duplicate.
+
+    With index given, the doomed chunks leave it and heirs in processed files join it.
+    """
+    if index is not None:
+        cur.execute("""
+            SELECT dc.id FROM document_chunks dc JOIN uploaded_files uf ON dc.file_id = uf.id
+            WHERE uf.original_name = ANY(%s)
+        """, (original_names,))
+        for (chunk_id,) in cur.fetchall():
+            index.discard(chunk_id)
+    cur.execute("""
+        WITH doomed AS (
+            SELECT dc.id, dc.embedding FROM document_chunks dc
+            JOIN uploaded_files uf ON dc.file_id = uf.id
+            WHERE uf.original_name = ANY(%s)
+        ),
+        heirs AS (
+            SELECT dup.canonical_id AS old_id,
+                   (ARRAY_AGG(dup.id ORDER BY uf.processed DESC, dup.id))[1] AS new_id  -- prefer searchable files
+            FROM document_chunks dup
+            JOIN uploaded_files uf ON dup.file_id = uf.id
+            WHERE dup.canonical_id IN (SELECT id FROM doomed) AND uf.original_name <> ALL(%s)
+            GROUP BY dup.canonical_id
+        )
+        UPDATE document_chunks dc
+        SET canonical_id = CASE WHEN dc.id = h.new_id THEN NULL ELSE h.new_id END,
+            embedding = CASE WHEN dc.id = h.new_id THEN d.embedding ELSE dc.embedding END
+        FROM heirs h JOIN doomed d ON d.id = h.old_id, uploaded_files uf
+        WHERE dc.canonical_id = h.old_id AND uf.id = dc.file_id
+        RETURNING dc.id, dc.canonical_id, dc.minhash, dc.figures_hash, uf.processed
+    """, (original_names, original_names))
+    relinked = cur.fetchall()
+    if relinked:
+        print(f"   Re-linked {len(relinked)} duplicate chunks to surviving canonicals")
+    if index is not None:
+        for chunk_id, canonical_id, signature, figures, processed in relinked:
+            if canonical_id is None and processed and signature is not None:
+                index.add(chunk_id, list(signature), figures)
 
 def extract_text(file_path: str) -> str:
     ext = Path(file_path).suffix.lower()
@@ -346,6 +503,179 @@ def extract_financial_lines(file_path: str, file_id: int, cur):
     except Exception as e:
         print(f"   Financial extraction failed: {e}")
 
+# ===================== RESUMABLE INGESTION =====================
+def file_checksum(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def reset_ingest_job(cur, original_name: str, index: NearDuplicateIndex):
+    """Discard a stored upload (journal, file row, chunks) — unfinished or outdated — so it restarts from scratch."""
+    release_canonical_chunks(cur, [original_name], index)
+    cur.execute("DELETE FROM uploaded_files WHERE original_name = %s", (original_name,))
+    cur.execute("DELETE FROM ingest_jobs WHERE original_name = %s", (original_name,))
+
+def remove_stale_jobs(cur, names_on_disk: set) -> List[str]:
+    """Release and delete unfinished uploads whose files are no longer on disk; returns their names."""
+    cur.execute("SELECT original_name FROM uploaded_files WHERE processed = FALSE")
+    stale = [name for (name,) in cur.fetchall() if name not in names_on_disk]
+    if stale:
+        release_canonical_chunks(cur, stale)
+        cur.execute("DELETE FROM uploaded_files WHERE original_name = ANY(%s) AND processed = FALSE", (stale,))  # jobs cascade
+    return stale
+
+def pending_chunk_ranges(total: int, covered: set) -> List[tuple]:
+    """(first, count) batches of at most CHUNK_BATCH_SIZE over the chunk positions not yet covered.
+
+    Works from the positions journaled batches actually cover, so a job survives a CHUNK_BATCH_SIZE change.
+    """
+    ranges, pos = [], 0
+    while pos < total:
+        if pos in covered:
+            pos += 1
+            continue
+        end = pos
+        while end < total and end - pos < CHUNK_BATCH_SIZE and end not in covered:
+            end += 1
+        ranges.append((pos, end - pos))
+        pos = end
+    return ranges
+
+def write_chunk_batch(cur, file_id: int, chunks: List[str], first: int, count: int, index: NearDuplicateIndex,
+                      job_index: NearDuplicateIndex) -> tuple:
+    """Embed and insert chunks[first:first + count]; returns (new canonical index entries, reused count)."""
+    batch = chunks[first:first + count]
+    signatures = [minhash_signature(c) for c in batch]
+    figures = [figures_hash(c) for c in batch]
+    links = plan_near_duplicates(signatures, figures, index, job_index)
+
+    # NEAR-DUPLICATES: only canonical chunks are sent to the embedding API
+    canonical_idx = [i for i, link in enumerate(links) if link is None]
+    embs = generate_embeddings([batch[i] for i in canonical_idx])
+    if any(not e or len(e) != 1536 for e in embs):
+        raise ValueError("Embedding failed — batch left for the next run")
+    chunk_embs = dict(zip(canonical_idx, embs))
+
+    chunk_ids, new_entries = {}, []
+    for i, chunk in enumerate(batch):
+        link = links[i]
+        if link is None:
+            cur.execute("""
+                INSERT INTO document_chunks (file_id, chunk_text, chunk_index, embedding, minhash, figures_hash)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (file_id, chunk, first + i, chunk_embs[i], signatures[i], figures[i]))
+            chunk_ids[i] = cur.fetchone()[0]
+            new_entries.append((chunk_ids[i], signatures[i], figures[i]))
+        else:
+            canonical_id = link[1] if link[0] == 'row' else chunk_ids[link[1]]
+            cur.execute("""
+                INSERT INTO document_chunks (file_id, chunk_text, chunk_index, canonical_id, minhash, figures_hash)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (file_id, chunk, first + i, canonical_id, signatures[i], figures[i]))
+    return new_entries, len(batch) - len(canonical_idx)
+
+def ingest_file(conn, cur, path: str, index: NearDuplicateIndex):
+    """Journaled upload: extracted → embedded (committed per chunk batch) → written. Resumes an unfinished job."""
+    file_info = classify_and_date_file(path)
+    name = file_info["filename"]
+    with open(path, 'rb') as f:
+        raw = f.read()
+    checksum = hashlib.sha256(raw).hexdigest()
+
+    text = extract_text(path)
+    chunks = chunk_text(text) if text.strip() else []
+    if not chunks:
+        print("   Empty text — skipping" if not text.strip() else "   No chunks — skipping")
+        # Drop any stored older version and record this checksum so the file is not re-extracted every run
+        reset_ingest_job(cur, name, index)
+        cur.execute("""
+            INSERT INTO ingest_jobs (original_name, checksum, total_chunks, state)
+            VALUES (%s, %s, 0, 'empty')
+        """, (name, checksum))
+        conn.commit()
+        return
+    n_batches = -(-len(chunks) // CHUNK_BATCH_SIZE)
+
+    # STATE 1: EXTRACTED (file row + journal entry), unless an identical job is already underway
+    cur.execute("SELECT id, file_id, checksum, total_chunks, state FROM ingest_jobs WHERE original_name = %s", (name,))
+    job = cur.fetchone()
+    if job and (job[2] != checksum or job[3] != len(chunks) or job[4] in ('written', 'empty')):
+        print("   File changed since the last upload — re-ingesting")
+        job = None
+    if job:
+        job_id, file_id = job[0], job[1]
+        job_index = load_near_duplicate_index(cur, file_id)
+        print(f"   Resuming job {job_id} (state: {job[4]})")
+    else:
+        job_index = NearDuplicateIndex()
+        reset_ingest_job(cur, name, index)
+        mime = SUPPORTED_MIME.get(Path(path).suffix.lower(), 'application/octet-stream')
+        cur.execute("""
+            INSERT INTO uploaded_files
+            (filename, original_name, mime_type, size, extracted_text, metadata, content)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            name, name, mime, len(raw),
+            text[:15000],  # Merged: Trim like provided
+            json.dumps({"file_type": file_info["type"], "upload_method": "v14"}),
+            base64.b64encode(raw).decode()
+        ))
+        file_id = cur.fetchone()[0]
+        cur.execute("""
+            INSERT INTO ingest_jobs (original_name, file_id, checksum, total_chunks, state)
+            VALUES (%s, %s, %s, %s, 'extracted')
+            RETURNING id
+        """, (name, file_id, checksum, len(chunks)))
+        job_id = cur.fetchone()[0]
+        conn.commit()
+        print(f"   Extracted: {len(chunks)} chunks in {n_batches} batches (job {job_id})")
+
+    # STATE 2: EMBEDDED — each batch commits its chunks together with its journal row
+    cur.execute("SELECT batch_no, first_chunk, chunk_count FROM ingest_batches WHERE job_id = %s", (job_id,))
+    done = cur.fetchall()
+    covered = {i for _, first, count in done for i in range(first, first + count)}
+    next_batch_no = max((row[0] for row in done), default=-1) + 1
+    ranges = pending_chunk_ranges(len(chunks), covered)
+    if covered:
+        print(f"   Skipping {len(covered)}/{len(chunks)} chunks already written")
+    for n, (first, count) in enumerate(ranges):
+        batch_no = next_batch_no + n
+        new_entries, reused = write_chunk_batch(cur, file_id, chunks, first, count, index, job_index)
+        cur.execute("""
+            INSERT INTO ingest_batches (job_id, batch_no, first_chunk, chunk_count, reused)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (job_id, batch_no, first, count, reused))
+        cur.execute("""
+            UPDATE ingest_jobs SET chunks_written = chunks_written + %s, updated_at = NOW() WHERE id = %s
+        """, (count, job_id))
+        conn.commit()
+        for entry in new_entries:
+            job_index.add(*entry)
+        print(f"   Batch {n + 1}/{len(ranges)}: chunks {first}-{first + count - 1}" + (f" ({reused} near-duplicates reused)" if reused else ""))
+    cur.execute("UPDATE ingest_jobs SET state = 'embedded', updated_at = NOW() WHERE id = %s AND state = 'extracted'", (job_id,))
+    conn.commit()
+
+    # STATE 3: WRITTEN — summary embedding (mean of stored vectors), structured data, processed flag
+    cur.execute("""
+        UPDATE uploaded_files SET embedding = (
+            SELECT AVG(COALESCE(dc.embedding, c.embedding))
+            FROM document_chunks dc LEFT JOIN document_chunks c ON dc.canonical_id = c.id
+            WHERE dc.file_id = %s
+        ) WHERE id = %s
+    """, (file_id, file_id))
+    if file_info["type"] == "member_dividend":
+        extract_member_dividends(path, file_id, cur)
+    elif file_info["type"] == "financial_report":
+        extract_financial_lines(path, file_id, cur)
+    cur.execute("UPDATE uploaded_files SET processed = TRUE WHERE id = %s", (file_id,))
+    cur.execute("UPDATE ingest_jobs SET state = 'written', updated_at = NOW() WHERE id = %s", (job_id,))
+    conn.commit()
+    # Only now are this file's canonicals searchable, so other files may link to them
+    for key, (signature, figures) in job_index.entries.items():
+        index.add(key, signature, figures)
+    print(f"   Success: {len(chunks)} chunks")
+
 # ===================== HYBRID SEARCH (UNCHANGED) =====================
 def get_structured_context(question: str, cur) -> str:
     """Query structured tables for comprehensive data (e.g., full member lists)"""
@@ -404,39 +734,65 @@ def get_structured_context(question: str, cur) -> str:
 
     return structured_ctx
 
-def ask(question: str, cur, top_k: int = 10) -> str:
-    # Get structured context first
-    structured_ctx = get_structured_context(question, cur)
+def answer_question(question: str, cur, top_k: int = 10) -> Dict[str, Any]:
+    """Retrieval-and-answer path; also reports retrieved chunk ids, per-stage timings (s) and token usage."""
+    result = {"question": question, "answer": None, "chunk_ids": [], "timings": {}, "usage": {}, "error": None}
+    timings, usage = result["timings"], result["usage"]
+    start = stage_start = time.perf_counter()
+
+    def mark(stage: str):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = round(now - stage_start, 4)
+        stage_start = now
 
-    # Embed question for RAG
     try:
-        emb = client.embeddings.create(input=question, model="text-embedding-ada-002").data[0].embedding
+        # Get structured context first
+        structured_ctx = get_structured_context(question, cur)
+        mark("structured")
+
+        # Embed question for RAG
+        emb_resp = client.embeddings.create(input=question, model="text-embedding-ada-002")
+        emb = emb_resp.data[0].embedding
+        if emb_resp.usage:
+            usage["embedding_tokens"] = emb_resp.usage.total_tokens
+        mark("embed")
+
         vec = '[' + ','.join(map(str, emb)) + ']'
         kws = [f"%{w}%" for w in re.findall(r'\b\w+\b', question.lower()) if len(w)>2]
 
         sql = """
         WITH q AS (SELECT %s::vector AS vec),
         vec_res AS (
-            SELECT dc.chunk_text, uf.original_name, 1 - (dc.embedding <=> (SELECT vec FROM q)) AS sim
+            SELECT dc.id AS group_id, dc.id AS chunk_id, dc.chunk_text, uf.original_name, 1 - (dc.embedding <=> (SELECT vec FROM q)) AS sim
             FROM document_chunks dc JOIN uploaded_files uf ON dc.file_id = uf.id
-            WHERE uf.processed = true
+            WHERE uf.processed = true AND dc.embedding IS NOT NULL
             ORDER BY dc.embedding <=> (SELECT vec FROM q) LIMIT %s
         ),
         kw_res AS (
-            SELECT dc.chunk_text, uf.original_name, 0.95 AS sim
+            SELECT COALESCE(dc.canonical_id, dc.id) AS group_id, dc.id AS chunk_id, dc.chunk_text, uf.original_name, 0.95 AS sim
             FROM document_chunks dc JOIN uploaded_files uf ON dc.file_id = uf.id
             WHERE uf.processed = true AND dc.chunk_text ILIKE ANY(%s)
+        ),
+        hits AS (
+            (SELECT group_id, chunk_id, chunk_text, original_name, sim FROM vec_res WHERE sim > 0.5)
+            UNION ALL (SELECT group_id, chunk_id, chunk_text, original_name, sim FROM kw_res)
+        ),
+        collapsed AS (  -- one row per canonical chunk: near-duplicates share a group_id
+            SELECT DISTINCT ON (group_id) chunk_id, chunk_text, original_name, sim
+            FROM hits ORDER BY group_id, sim DESC
         )
-        (SELECT chunk_text, original_name, sim FROM vec_res WHERE sim > 0.5)
-        UNION ALL (SELECT chunk_text, original_name, sim FROM kw_res)
+        SELECT chunk_id, chunk_text, original_name, sim FROM collapsed
         ORDER BY sim DESC LIMIT %s;
         """
         cur.execute(sql, (vec, top_k*2, kws, top_k))
         results = cur.fetchall()
+        result["chunk_ids"] = [r[0] for r in results]  # rows whose text went into the prompt
+        mark("retrieve")
         if not results:
             rag_ctx = "No relevant text chunks found."
         else:
-            rag_ctx = "\n\n".join([f"[{r[2]:.3f}] {r[1]}:\n{r[0]}" for r in results])
+            rag_ctx = "\n\n".join([f"[{r[3]:.3f}] {r[2]}:\n{r[1]}" for r in results])
 
         full_context = f"{rag_ctx}{structured_ctx}"
 
@@ -454,25 +810,165 @@ Answer in Swahili or English, comprehensive and detailed, list all relevant info
             temperature=0.3,
             max_tokens=1000
         )
-        return resp.choices[0].message.content.strip()
+        if resp.usage:
+            usage["prompt_tokens"] = resp.usage.prompt_tokens
+            usage["completion_tokens"] = resp.usage.completion_tokens
+        mark("generate")
+        result["answer"] = resp.choices[0].message.content.strip()
     except Exception as e:
         print(f"Query error: {e}")
-        return "Sorry, there was an error processing your question."
+        result["error"] = str(e)
+        result["answer"] = "Sorry, there was an error processing your question."
+    timings["total"] = round(time.perf_counter() - start, 4)
+    return result
+
+def ask(question: str, cur, top_k: int = 10) -> str:
+    return answer_question(question, cur, top_k)["answer"]
+
+# ===================== BATCH EVALUATION =====================
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """Questions from JSONL ({"id": ..., "question": ...} or plain strings) or CSV (a 'question' column, else the first)."""
+    ext = Path(path).suffix.lower()
+    if ext == '.jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        items = [r if isinstance(r, dict) else {"question": str(r)} for r in rows]
+    elif ext == '.csv':
+        df = pd.read_csv(path)
+        col = 'question' if 'question' in df.columns else df.columns[0]
+        ids = df['id'] if 'id' in df.columns else df.index
+        items = [{"id": i.item() if hasattr(i, "item") else i, "question": str(q)} for i, q in zip(ids, df[col]) if pd.notna(q)]
+    else:
+        raise ValueError(f"Unsupported question file {path} (use .jsonl or .csv)")
+    questions = []
+    for n, item in enumerate(items):
+        q = str(item.get("question", "")).strip()
+        if q:
+            questions.append({"id": item.get("id", n), "question": q})
+    return questions
+
+def print_latency_report(results: List[Dict[str, Any]], wall_time: float):
+    """Throughput and latency over successful answers only; errors fail fast and would flatter the numbers."""
+    ok = [r for r in results if not r["error"]]
+    errors = len(results) - len(ok)
+    totals = [r["timings"]["total"] for r in ok]
+    print("\n📊 BATCH SUMMARY")
+    print(f"Questions: {len(results)} in {wall_time:.2f}s")
+    print(f"Errors: {errors} ({errors / len(results):.1%})" if results else "Errors: 0")
+    print(f"Throughput: {len(ok) / wall_time:.2f} answered questions/s" if wall_time > 0 else "Throughput: n/a")
+    if totals:
+        p50, p95, p99 = np.percentile(totals, [50, 95, 99])
+        print(f"Latency: p50={p50:.3f}s  p95={p95:.3f}s  p99={p99:.3f}s  max={max(totals):.3f}s")
+    for stage in ["structured", "embed", "retrieve", "generate"]:
+        values = [r["timings"][stage] for r in ok if stage in r["timings"]]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            print(f"   {stage:<10} p50={p50:.3f}s  p95={p95:.3f}s  p99={p99:.3f}s")
+    token_totals = {}
+    for r in results:
+        for k, v in r["usage"].items():
+            token_totals[k] = token_totals.get(k, 0) + (v or 0)
+    if token_totals:
+        print("Tokens: " + ", ".join(f"{k}={v}" for k, v in token_totals.items()))
+
+# Columns answer_question() reads; a DB last written by an older uploader lacks canonical_id
+BATCH_REQUIRED_COLUMNS = [
+    ("uploaded_files", "original_name"), ("uploaded_files", "processed"),
+    ("document_chunks", "chunk_text"), ("document_chunks", "embedding"), ("document_chunks", "canonical_id"),
+]
+
+def missing_batch_columns(cur) -> List[str]:
+    cur.execute("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name IN ('uploaded_files', 'document_chunks')
+    """)
+    present = set(cur.fetchall())
+    return [f"{t}.{c}" for t, c in BATCH_REQUIRED_COLUMNS if (t, c) not in present]
+
+def run_batch(path: str, concurrency: int = 4, output: Optional[str] = None, top_k: int = 10):
+    """Answer every question in path with `concurrency` workers (one DB connection each), write JSONL results."""
+    questions = load_questions(path)
+    output = output or str(Path(path).with_suffix('.answers.jsonl'))
+    print(f"Batch: {len(questions)} questions from {path}, concurrency={concurrency} → {output}")
+    if not questions:
+        return
+
+    with psycopg.connect(DATABASE_URL) as conn, conn.cursor() as cur:
+        missing = missing_batch_columns(cur)
+    if missing:
+        sys.exit(f"❌ Database schema is out of date (missing {', '.join(missing)}). "
+                 f"Run python3 upload_financials.py once to upgrade it, then retry the batch.")
+
+    local = threading.local()
+    conns, conns_lock = [], threading.Lock()
+
+    def worker(item: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            if not hasattr(local, "conn"):
+                local.conn = psycopg.connect(DATABASE_URL)
+                with conns_lock:
+                    conns.append(local.conn)
+            with local.conn.cursor() as cur:
+                result = answer_question(item["question"], cur, top_k)
+            local.conn.rollback()  # end the read transaction (also clears an aborted one)
+        except Exception as e:
+            # e.g. connection slots exhausted at high concurrency: record it and keep the run going
+            print(f"   Worker error on {item['id']}: {e}")
+            if hasattr(local, "conn") and local.conn.closed:
+                del local.conn  # reconnect on the next question
+            result = {"question": item["question"], "answer": None, "chunk_ids": [], "usage": {},
+                      "timings": {"total": round(time.perf_counter() - start, 4)}, "error": str(e)}
+        return {"id": item["id"], **result}
+
+    results = []
+    wall_start = time.perf_counter()
+    try:
+        with open(output, 'w', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = [pool.submit(worker, q) for q in questions]
+            for done, future in enumerate(as_completed(futures), 1):
+                r = future.result()
+                results.append(r)
+                out.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
+                status = "error" if r["error"] else f"{len(r['chunk_ids'])} chunks"
+                print(f"   [{done}/{len(questions)}] {r['id']}: {r['timings']['total']:.2f}s ({status})")
+    finally:
+        for conn in conns:
+            conn.close()
+    print_latency_report(results, time.perf_counter() - wall_start)
 
 # ===================== MAIN =====================
+def parse_args():
+    parser = argparse.ArgumentParser(description="SOYOSOYO SACCO uploader + chatbot")
+    parser.add_argument("--batch", metavar="FILE", help="answer questions from a .jsonl/.csv file instead of uploading")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel questions in batch mode (default 4)")
+    parser.add_argument("--output", metavar="FILE", help="batch results JSONL (default <FILE>.answers.jsonl)")
+    parser.add_argument("--top-k", type=int, default=10, help="chunks retrieved per question (default 10)")
+    parser.add_argument("--reset", action="store_true", help="drop all tables before uploading (discards resumable jobs)")
+    return parser.parse_args()
+
 def main():
     print("SOYOSOYO SACCO CHATBOT + UPLOADER v14 – FERRARI EDITION (MERGED IMPROVEMENTS)")
+    args = parse_args()
+
+    # BATCH MODE: evaluate against the existing database, no schema changes or uploads
+    if args.batch:
+        run_batch(args.batch, args.concurrency, args.output, args.top_k)
+        return
 
     conn = psycopg.connect(DATABASE_URL)
     cur = conn.cursor()
 
-    # STEP 1: ENSURE SCHEMA
-    print("Dropping existing tables for clean schema (data loss expected)...")
-    cur.execute("DROP TABLE IF EXISTS member_dividends CASCADE;")
-    cur.execute("DROP TABLE IF EXISTS financial_report_lines CASCADE;")
-    cur.execute("DROP TABLE IF EXISTS document_chunks CASCADE;")
-    cur.execute("DROP TABLE IF EXISTS uploaded_files CASCADE;")
-    print("Tables dropped. Recreating schema...")
+    # STEP 1: ENSURE SCHEMA (kept across runs so interrupted uploads can resume)
+    if args.reset:
+        print("Dropping existing tables for clean schema (data loss expected)...")
+        cur.execute("DROP TABLE IF EXISTS ingest_batches CASCADE;")
+        cur.execute("DROP TABLE IF EXISTS ingest_jobs CASCADE;")
+        cur.execute("DROP TABLE IF EXISTS member_dividends CASCADE;")
+        cur.execute("DROP TABLE IF EXISTS financial_report_lines CASCADE;")
+        cur.execute("DROP TABLE IF EXISTS document_chunks CASCADE;")
+        cur.execute("DROP TABLE IF EXISTS uploaded_files CASCADE;")
+        print("Tables dropped. Recreating schema...")
 
     cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
     cur.execute("""
@@ -496,9 +992,18 @@ def main():
             file_id INTEGER REFERENCES uploaded_files(id) ON DELETE CASCADE,
             chunk_text TEXT NOT NULL,
             chunk_index INTEGER,
-            embedding VECTOR(1536)
+            embedding VECTOR(1536),  -- NULL for near-duplicates (see canonical_id)
+            canonical_id INTEGER REFERENCES document_chunks(id) ON DELETE SET NULL,
+            minhash BIGINT[],
+            figures_hash BIGINT
         );
     """)
+    cur.execute("""
+        ALTER TABLE document_chunks
+            ADD COLUMN IF NOT EXISTS canonical_id INTEGER REFERENCES document_chunks(id) ON DELETE SET NULL,
+            ADD COLUMN IF NOT EXISTS minhash BIGINT[],
+            ADD COLUMN IF NOT EXISTS figures_hash BIGINT;
+    """)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS member_dividends (
             id SERIAL PRIMARY KEY,
@@ -521,10 +1026,34 @@ def main():
             line_date DATE
         );
     """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id SERIAL PRIMARY KEY,
+            original_name TEXT NOT NULL UNIQUE,
+            file_id INTEGER REFERENCES uploaded_files(id) ON DELETE CASCADE,
+            checksum TEXT NOT NULL,  -- sha256 of the file; a changed file restarts its job
+            total_chunks INTEGER NOT NULL,
+            chunks_written INTEGER DEFAULT 0,
+            state TEXT NOT NULL,  -- extracted → embedded → written, or empty (no text: nothing stored)
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_batches (
+            job_id INTEGER REFERENCES ingest_jobs(id) ON DELETE CASCADE,
+            batch_no INTEGER NOT NULL,
+            first_chunk INTEGER NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            reused INTEGER DEFAULT 0,  -- near-duplicates that skipped the embedding API
+            written_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (job_id, batch_no)
+        );
+    """)
     cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_files_processed ON uploaded_files (processed);
         CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON document_chunks USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
         CREATE INDEX IF NOT EXISTS idx_chunks_file ON document_chunks (file_id);
+        CREATE INDEX IF NOT EXISTS idx_chunks_canonical ON document_chunks (canonical_id);
         CREATE INDEX IF NOT EXISTS idx_members_name ON member_dividends (name);
         CREATE INDEX IF NOT EXISTS idx_financial_account ON financial_report_lines (account);
     """)
@@ -539,6 +1068,12 @@ def main():
         for e in SUPPORTED_EXTENSIONS:
             files.extend(glob.glob(f"{d}**/*{e}", recursive=True))
 
+    # Unfinished uploads whose files are gone would never complete: release and drop them
+    stale = remove_stale_jobs(cur, {os.path.basename(f) for f in files})
+    if stale:
+        print(f"Removed {len(stale)} unfinished uploads no longer on disk: {', '.join(stale)}")
+    conn.commit()
+
     if not files:
         print("No files found.")
     else:
@@ -558,94 +1093,43 @@ def main():
         old_names = [mf["filename"] for mf in monthly_files
                      if latest_by_type.get(mf["type"])["path"] != mf["path"]]
 
-        if old_names:
-            print(f"Deleting {len(old_names)} old monthly files from DB...")
-            cur.execute("DELETE FROM document_chunks WHERE file_id IN (SELECT id FROM uploaded_files WHERE original_name = ANY(%s))", (old_names,))
-            cur.execute("DELETE FROM uploaded_files WHERE original_name = ANY(%s) RETURNING original_name", (old_names,))
-            for (name,) in cur.fetchall():
-                print(f"   Removed: {name}")
-
-        # Check existing processed files
-        cur.execute("SELECT original_name FROM uploaded_files WHERE processed = true")
-        existing = {row[0] for row in cur.fetchall()}
+        # Up to date = journal says written with the same sha256 as the file on disk;
+        # edited files (e.g. an updated bylaws PDF) and unfinished jobs are (re-)ingested
+        cur.execute("SELECT original_name, checksum FROM ingest_jobs WHERE state IN ('written', 'empty')")
+        existing = dict(cur.fetchall())
 
         to_upload = []
-        for mf in latest_by_type.values():
-            if mf["filename"] not in existing:
-                to_upload.append(mf["path"])
-        for sf in static_files:
-            if sf["filename"] not in existing:
-                to_upload.append(sf["path"])
+        for f in list(latest_by_type.values()) + static_files:
+            if existing.get(f["filename"]) != file_checksum(f["path"]):
+                to_upload.append(f["path"])
 
-        print(f"Uploading {len(to_upload)} new files...")
+        print(f"Uploading {len(to_upload)} new or changed files...")
+        near_dup_index = load_near_duplicate_index(cur)
 
         for path in to_upload:
             print(f"\nUploading: {os.path.basename(path)}")
-            text = extract_text(path)
-            if not text.strip():
-                print("   Empty text — skipping")
-                continue
-
-            chunks = chunk_text(text)
-            if not chunks:
-                print("   No chunks — skipping")
-                continue
-
-            chunk_embs = generate_embeddings(chunks)
-            summary_emb = generate_summary_embedding(chunks)
-
-            with open(path, 'rb') as f:
-                content = base64.b64encode(f.read()).decode()
-
-            file_info = classify_and_date_file(path)
-            mime = SUPPORTED_MIME.get(Path(path).suffix.lower(), 'application/octet-stream')
-
             try:
-                # INSERT FILE (processed = FALSE initially)
-                cur.execute("""
-                    INSERT INTO uploaded_files
-                    (filename, original_name, mime_type, size, extracted_text, metadata, content, embedding)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    file_info["filename"], file_info["filename"], mime,
-                    os.path.getsize(path),
-                    text[:15000],  # Merged: Trim like provided
-                    json.dumps({"file_type": file_info["type"], "upload_method": "v14"}),
-                    content, summary_emb
-                ))
-                file_id = cur.fetchone()[0]
-
-                # INSERT CHUNKS (only valid 1536-dim)
-                valid_chunks = 0
-                for i, (chunk, emb) in enumerate(zip(chunks, chunk_embs)):
-                    if emb and len(emb) == 1536:
-                        cur.execute("""
-                            INSERT INTO document_chunks (file_id, chunk_text, chunk_index, embedding)
-                            VALUES (%s, %s, %s, %s)
-                        """, (file_id, chunk, i, emb))
-                        valid_chunks += 1
-
-                if valid_chunks == 0:
-                    raise ValueError("No valid embeddings")
-
-                # STRUCTURED DATA
-                if file_info["type"] == "member_dividend":
-                    extract_member_dividends(path, file_id, cur)
-                elif file_info["type"] == "financial_report":
-                    extract_financial_lines(path, file_id, cur)
-
-                # MARK PROCESSED
-                cur.execute("UPDATE uploaded_files SET processed = TRUE WHERE id = %s", (file_id,))
-                print(f"   Success: {valid_chunks} chunks")
-
-                conn.commit()  # Commit per file for safety
-
+                ingest_file(conn, cur, path, near_dup_index)
             except Exception as e:
-                print(f"   Failed: {e}")
+                print(f"   Failed: {e} (committed batches are kept; next run resumes)")
                 conn.rollback()
                 continue
 
+        # Monthly cleanup runs after ingestion: old months stay searchable until their replacement is
+        # written, and their embeddings pass to the new month's near-duplicate rows instead of being re-embedded
+        cur.execute("SELECT original_name FROM ingest_jobs WHERE state = 'written'")
+        written = {row[0] for row in cur.fetchall()}
+        old_names = [mf["filename"] for mf in monthly_files
+                     if mf["filename"] in old_names and latest_by_type[mf["type"]]["filename"] in written]
+        if old_names:
+            print(f"\nDeleting {len(old_names)} old monthly files from DB...")
+            release_canonical_chunks(cur, old_names, near_dup_index)
+            cur.execute("DELETE FROM document_chunks WHERE file_id IN (SELECT id FROM uploaded_files WHERE original_name = ANY(%s))", (old_names,))
+            cur.execute("DELETE FROM uploaded_files WHERE original_name = ANY(%s) RETURNING original_name", (old_names,))
+            for (name,) in cur.fetchall():
+                print(f"   Removed: {name}")
+            conn.commit()
+
         # Disk cleanup
         if DELETE_OLD_FROM_DISK and old_names:
             for mf in monthly_files: